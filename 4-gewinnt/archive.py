@@ -0,0 +1,359 @@
+import argparse
+import json
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator, Optional, TextIO
+
+import numpy as np
+
+from board import Board
+from computer import Computer
+
+worker_settings: dict[str, Optional[float]] = {}
+
+
+def read_games(lines: Iterable[str]) -> Iterator[tuple[int, list[int], Optional[str]]]:
+    """
+    Lazily reads game records, one game per line, written as the x-indices of the played columns, e.g. "3324".
+    Whitespace and commas between the moves are ignored, as well as empty lines and lines starting with #
+    :param lines: the lines of the archive, e.g. an opened file
+    :return: an iterator over the line number, the moves and the error of every game,
+        the error being None unless the line contains something other than column indices
+    """
+    for line_number, line in enumerate(lines, start=1):
+        record = line.strip()
+        if not record or record.startswith("#"):
+            continue
+
+        moves = [character for character in record if character not in " \t,"]
+        if not all(move in "0123456" for move in moves):
+            yield line_number, [], f"Line {line_number} is not a valid game record: {record!r}"
+            continue
+
+        yield line_number, [int(move) for move in moves], None
+
+
+def replay(moves: list[int]) -> Iterator[Board]:
+    """
+    Places the moves one after another and returns the board before each of them
+    :param moves: the x-indices of the played columns
+    :return: an iterator over copies of the board, the n-th board being the position the n-th move was played in
+    :raises ValueError: if a move is played into a full column or after the game is over
+    """
+    board = Board(np.zeros((6, 7)))
+    for move in moves:
+        if board.is_game_over()[0]:
+            raise ValueError("Cannot place marker because the game is already over")
+        yield Board(board.field.copy())
+        board.place_marker(move)
+
+
+def init_worker(depth: Optional[int], time_limit: Optional[float]) -> None:
+    """
+    Sets up a worker process of the pool
+    :param depth: how many moves the computer shall look into the future, None for the modular depth
+    :param time_limit: seconds the computer may spend on every position, None for no limit
+    :return: None, since this method is a modifier
+    """
+    worker_settings["depth"], worker_settings["time_limit"] = depth, time_limit
+
+
+def analyze_position(field: bytes) -> dict[int, int]:
+    """
+    Runs the computer on a position inside a worker process
+    :param field: the field of the board as bytes
+    :return: a dict mapping the x-index of every possible column to its value
+    """
+    board = Board(np.frombuffer(field).reshape((6, 7)).copy())
+    computer = Computer(board, board.current_player)
+    analysis = computer.analyze(board, depth=worker_settings["depth"], time_limit=worker_settings["time_limit"])
+    return {move: move_analysis.value for move, move_analysis in analysis.items()}
+
+
+def annotate_move(ply: int, player: int, move: int, values: dict[int, int]) -> dict:
+    """
+    Compares the played move to the best move of a position
+    :param ply: index of the move inside the game
+    :param player: the player who made the move, 1 = yellow, 2 = red
+    :param move: the x-index of the played column
+    :param values: the value of every possible column
+    :return: the annotation of the move
+    """
+    sign = 1 if player == 1 else -1  # turns the values into the view of the player
+    best_move = max(values, key=lambda column: sign * values[column])
+
+    return {
+        "ply": ply,
+        "player": player,
+        "move": move,
+        "value": values[move],
+        "best_move": best_move,
+        "best_value": values[best_move],
+        "loss": sign * (values[best_move] - values[move]),
+        "blunder": sign * values[move] == -42 and sign * values[best_move] != -42,
+        "missed_win": sign * values[best_move] == 42 and sign * values[move] != 42,
+    }
+
+
+class ArchiveAnnotator:
+    """
+    Annotates the games of an archive with a pool of worker processes.
+    Positions get analyzed only once, no matter how many games they occur in, and the annotations are written
+    in the order of the archive as soon as every position of a game is analyzed
+    """
+    executor: ProcessPoolExecutor
+    processes: Optional[int]
+    depth: Optional[int]
+    time_limit: Optional[float]
+    output: TextIO
+    progress: Callable[[str], None]
+
+    cache: OrderedDict[bytes, dict[int, int]]  # values of recently analyzed positions, the oldest get dropped first
+    pending: dict[bytes, Future]  # positions that are currently analyzed by a worker
+    # line number, moves, positions with their (pending) values and error of the games to be written
+    games: deque[tuple[int, list[int], list[tuple[bytes, dict[int, int] | Future]], Optional[str]]]
+
+    cache_size: int
+    max_pending: int
+    report_interval: float
+
+    started_at: float
+    last_report: float
+    games_written: int
+    positions: int
+    cache_hits: int
+
+    def __init__(self, output: TextIO, *, processes: Optional[int] = None, depth: Optional[int] = None,
+                 time_limit: Optional[float] = None, cache_size: int = 100_000, max_pending: int = 1_000,
+                 report_interval: float = 5.0, progress: Optional[Callable[[str], None]] = None):
+        """
+        :param output: where the annotations get written to, one JSON object per line and game
+        :param processes: the number of worker processes, defaults to the number of CPUs
+        :param depth: how many moves the computer shall look into the future, None for the modular depth
+        :param time_limit: seconds the computer may spend on every position, None for no limit
+        :param cache_size: how many analyzed positions are kept to be reused by later games
+        :param max_pending: how many positions and games may wait for analysis, this bounds the memory usage
+        :param report_interval: seconds between two progress reports
+        :param progress: gets called with every progress report, defaults to printing to stderr
+        """
+        self.processes, self.depth, self.time_limit = processes, depth, time_limit
+        self.executor = self.create_executor()
+        self.output = output
+        self.progress = progress if progress is not None else lambda report: print(report, file=sys.stderr)
+
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.games = deque()
+
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self.report_interval = report_interval
+
+        self.started_at = self.last_report = time.perf_counter()
+        self.games_written, self.positions, self.cache_hits = 0, 0, 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.executor.shutdown(cancel_futures=exc_info[0] is not None)
+
+    def create_executor(self) -> ProcessPoolExecutor:
+        """
+        Starts a new pool of worker processes
+        :return: the pool
+        """
+        return ProcessPoolExecutor(max_workers=self.processes, initializer=init_worker,
+                                   initargs=(self.depth, self.time_limit))
+
+    def submit(self, field: bytes) -> Future:
+        """
+        Hands a position to the workers, replacing the pool if a crashed worker broke it
+        :param field: the field of the board as bytes
+        :return: the future of the worker analyzing the position
+        """
+        try:
+            return self.executor.submit(analyze_position, field)
+        except BrokenProcessPool:
+            self.executor.shutdown(wait=False)
+            self.executor = self.create_executor()
+            return self.executor.submit(analyze_position, field)
+
+    def resubmit_broken(self) -> None:
+        """
+        Hands the positions again to the workers whose analysis got lost because the pool broke
+        :return: None, since this method is a modifier
+        """
+        for field, future in list(self.pending.items()):
+            if future.done() and not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self.pending[field] = self.submit(field)
+
+    def add_game(self, line_number: int, moves: list[int], error: Optional[str] = None) -> None:
+        """
+        Replays a game and hands its positions to the workers, unless they were already analyzed
+        :param line_number: the line of the game inside the archive
+        :param moves: the x-indices of the played columns
+        :param error: if the record could not be read, the game only gets written with this error
+        :return: None, since this method is a modifier
+        """
+        if time.perf_counter() - self.last_report >= self.report_interval:
+            self.report()
+
+        # Make room first, so neither the queue of games nor the positions in work grow past their limit
+        while self.games and (len(self.games) >= self.max_pending or len(self.pending) >= self.max_pending):
+            self.write_next_game()
+
+        if error is not None:
+            self.games.append((line_number, moves, [], error))
+            return
+
+        try:
+            fields = [board.field.tobytes() for board in replay(moves)]
+        except ValueError as replay_error:
+            self.games.append((line_number, moves, [], str(replay_error)))
+            return
+
+        analyses, submitted = [], []
+        for field in fields:
+            self.positions += 1
+            if field in self.cache:
+                self.cache_hits += 1
+                self.cache.move_to_end(field)
+                analyses.append(self.cache[field])
+            elif field in self.pending:
+                self.cache_hits += 1
+                analyses.append(self.pending[field])
+            else:
+                try:
+                    self.pending[field] = self.submit(field)
+                except Exception as submit_error:
+                    # Nothing waits for the positions handed over so far, so they must not block later games
+                    for submitted_field in submitted:
+                        del self.pending[submitted_field]
+                    self.games.append((line_number, moves, [], f"Analysis failed: {submit_error!r}"))
+                    return
+                submitted.append(field)
+                analyses.append(self.pending[field])
+        self.games.append((line_number, moves, list(zip(fields, analyses)), None))
+
+    def write_next_game(self) -> None:
+        """
+        Waits for the analysis of the oldest game and writes its annotation
+        :return: None, since this method is a modifier
+        """
+        line_number, moves, positions, error = self.games.popleft()
+
+        if error is not None:
+            annotation = {"line": line_number, "moves": moves, "error": error}
+        else:
+            try:
+                plies = []
+                for ply, (move, (field, analysis)) in enumerate(zip(moves, positions)):
+                    values = self.get_values(field, analysis)
+                    plies.append(annotate_move(ply, 1 if ply % 2 == 0 else 2, move, values))
+                annotation = {"line": line_number, "moves": moves, "plies": plies}
+            # A single position failing, or even a crashed worker, must not end the whole run
+            except Exception as analysis_error:
+                # Games still queued keep their own futures, so the rest of this game must not block the limit
+                for field, _ in positions:
+                    self.pending.pop(field, None)
+                annotation = {"line": line_number, "moves": moves, "error": f"Analysis failed: {analysis_error!r}"}
+
+        self.output.write(json.dumps(annotation) + "\n")
+        self.output.flush()
+        self.games_written += 1
+
+        if time.perf_counter() - self.last_report >= self.report_interval:
+            self.report()
+
+    def get_values(self, field: bytes, analysis: dict[int, int] | Future, retry: bool = True) -> dict[int, int]:
+        """
+        Returns the values of an analyzed position, waiting for the worker if necessary
+        :param field: the field of the board as bytes
+        :param analysis: the values of the position, or the future of the worker analyzing it
+        :param retry: if the position gets analyzed once more when a crashed worker broke the pool
+        :return: a dict mapping the x-index of every possible column to its value
+        :raises Exception: whatever the worker raised while analyzing the position
+        """
+        if not isinstance(analysis, Future):
+            return analysis
+
+        try:
+            values = analysis.result()
+        except BrokenProcessPool:
+            if not retry:
+                if self.pending.get(field) is analysis:
+                    del self.pending[field]
+                raise
+            # The crashed worker might have been analyzing any position, so all lost ones get another chance
+            self.resubmit_broken()
+            if field in self.cache:
+                return self.cache[field]
+            if self.pending.get(field) in (None, analysis):
+                self.pending[field] = self.submit(field)
+            return self.get_values(field, self.pending[field], retry=False)
+        except Exception:
+            if self.pending.get(field) is analysis:
+                del self.pending[field]
+            raise
+
+        if self.pending.get(field) is analysis:
+            del self.pending[field]
+            self.cache[field] = values
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return values
+
+    def finish(self) -> None:
+        """
+        Writes the annotations of all remaining games
+        :return: None, since this method is a modifier
+        """
+        while self.games:
+            self.write_next_game()
+        self.report()
+
+    def report(self) -> None:
+        """
+        Reports how far the annotation got and how fast it is going
+        :return: None
+        """
+        self.last_report = time.perf_counter()
+        elapsed = self.last_report - self.started_at
+        self.progress(f"{self.games_written} games, {self.positions} positions "
+                      f"({self.cache_hits} from cache) in {elapsed:.1f}s, "
+                      f"{self.games_written / elapsed:.1f} games/s, {self.positions / elapsed:.1f} positions/s")
+
+
+def annotate_archive(games: Iterable[str], output: TextIO, **options) -> None:
+    """
+    Annotates every game of an archive with the value of each move, as well as blunders and missed wins
+    :param games: the lines of the archive, see read_games for the format
+    :param output: where the annotations get written to, one JSON object per line and game
+    :param options: passed to ArchiveAnnotator
+    :return: None
+    """
+    with ArchiveAnnotator(output, **options) as annotator:
+        for line_number, moves, error in read_games(games):
+            annotator.add_game(line_number, moves, error)
+        annotator.finish()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Annotates an archive of played 4-Gewinnt games")
+    parser.add_argument("archive", help="file with one game per line, written as the x-indices of the played columns")
+    parser.add_argument("output", help="file the annotations get written to, one JSON object per line")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--depth", type=int, default=None, help="search depth, defaults to the modular depth")
+    parser.add_argument("--time-limit", type=float, default=None, help="seconds per position")
+    args = parser.parse_args()
+
+    with open(args.archive) as games, open(args.output, "w") as output:
+        annotate_archive(games, output, processes=args.processes, depth=args.depth, time_limit=args.time_limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
+import time
+from typing import Optional
+
 from board import Board
+from threats import ThreatAnalyzer
 
 
 def get_modular_depth(filled_fields: int) -> int:
@@ -20,13 +24,39 @@ def get_modular_depth(filled_fields: int) -> int:
     return 42 - filled_fields  # this is the max depth until every marker is placed
 
 
+class MoveAnalysis:
+    value: int  # evaluation after the move, positive values favor yellow and negative values favor red
+    principal_variation: list[int]  # the expected sequence of columns, starting with the analyzed move
+    nodes: int  # number of positions visited while searching the move, summed over all searched depths
+
+    def __init__(self, value: int, principal_variation: list[int], nodes: int):
+        self.value = value
+        self.principal_variation = principal_variation
+        self.nodes = nodes
+
+    def __repr__(self):
+        return f"MoveAnalysis(value={self.value}, principal_variation={self.principal_variation}, nodes={self.nodes})"
+
+
 class Computer:
     board: Board
     color: int
+    nodes: int  # number of positions visited by minimax during the latest search
+
+    # maps (field, maximize) to (depth, score, bound, principal variation) of positions searched during the latest analysis
+    transposition_table: dict[tuple[bytes, bool], tuple[int, int, int, tuple[int, ...]]]
+    deadline: Optional[float]  # time.perf_counter() value at which a running search gets aborted
+
+    ZUGZWANG_SCORE: int = 10  # bonus for the player who is predicted to win by the odd/even rules
+    TABLE_SIZE: int = 200_000  # the transposition table gets cleared once it holds more positions than this
+    EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2  # what kind of score a transposition table entry holds
 
     def __init__(self, board: Board, color):
         self.board = board
         self.color = color
+        self.nodes = 0
+        self.transposition_table = {}
+        self.deadline = None
 
     @property
     def should_maximize(self):
@@ -38,7 +68,7 @@ class Computer:
         Uses minimax and heuristic evaluation to search into future board states
         :return: the x-index of the column in which a marker should be dropped
         """
-        best_move = None
+        self.nodes = 0
         modular_depth = get_modular_depth(self.board.filled_fields())
 
         # Check directly if the computer can win in the next move
@@ -50,27 +80,78 @@ class Computer:
                 return move
 
         # If the computer cannot win directly, all possible board combinations get generated and evaluated
+        analysis = self.analyze(depth=modular_depth)
         if self.should_maximize:
-            max_score = -43
-            for move in self.board.get_possible_moves():
-                next_board = Board(self.board.field.copy())
-                next_board.place_marker(move)
-                score = self.minimax(board=next_board, maximize=False, alpha=-42, beta=42, depth=modular_depth)
-                if score > max_score:
-                    max_score = score
-                    best_move = move
-        else:
-            min_score = 43
-            for move in self.board.get_possible_moves():
-                next_board = Board(self.board.field.copy())
-                next_board.place_marker(move)
-                score = self.minimax(board=next_board, maximize=True, alpha=-42, beta=42, depth=modular_depth)
-                if score < min_score:
-                    min_score = score
-                    best_move = move
-        return best_move
+            return max(analysis, key=lambda move: analysis[move].value)
+        return min(analysis, key=lambda move: analysis[move].value)
 
-    def minimax(self, board: Board, maximize: bool, alpha: int, beta: int, depth: int) -> int:
+    def analyze(self, board: Optional[Board] = None, *, depth: Optional[int] = None,
+                time_limit: Optional[float] = None) -> dict[int, MoveAnalysis]:
+        """
+        Evaluates every possible move of the player to move, e.g. to give hints or to review a finished game.
+        All moves are searched with one transposition table, so positions reached after different moves get searched once.
+        With a time limit, the depth gets increased step by step until the time is up
+        WARNING: if both depth and time_limit are given, the search stops at whichever is reached first
+        :param board: the board to analyze, defaults to the board of the computer
+        :param depth: how many moves the algorythm shall look into the future after each move
+        :param time_limit: seconds after which the search is stopped, the deepest fully searched depth gets returned
+        :return: a dict mapping the x-index of every possible column to its analysis
+        """
+        board = board if board is not None else self.board
+        if depth is None:
+            depth = get_modular_depth(board.filled_fields()) if time_limit is None else 42 - board.filled_fields()
+        self.transposition_table.clear()  # results of earlier analyses must not end up in this one
+        if board.is_game_over()[0]:
+            return {}
+
+        self.nodes = 0
+        # Without a time limit, the shallower depths would only order the moves and cost more than they save
+        if time_limit is None:
+            return self.analyze_depth(board, depth)
+
+        deadline = time.perf_counter() + time_limit
+        self.deadline = None  # the first iteration always finishes, so there is a result to return
+        analysis = {}
+        try:
+            for current_depth in range(depth + 1):
+                try:
+                    depth_analysis = self.analyze_depth(board, current_depth)
+                except TimeoutError:
+                    break
+                for move, move_analysis in depth_analysis.items():
+                    move_analysis.nodes += analysis[move].nodes if move in analysis else 0
+                analysis = depth_analysis
+                self.deadline = deadline
+
+                # Every move leads to a certain win or loss, searching deeper won't change anything
+                if all(abs(move_analysis.value) == 42 for move_analysis in analysis.values()):
+                    break
+        finally:
+            self.deadline = None
+
+        return analysis
+
+    def analyze_depth(self, board: Board, depth: int) -> dict[int, MoveAnalysis]:
+        """
+        Searches every possible move of the board to the given depth with a full window, so each one gets an exact score
+        :param board: the board to analyze
+        :param depth: how many moves the algorythm shall look into the future after each move
+        :return: a dict mapping the x-index of every possible column to its analysis
+        :raises TimeoutError: if the deadline was reached during the search
+        """
+        analysis = {}
+        for move in board.get_possible_moves():
+            next_board = Board(board.field.copy())
+            next_board.place_marker(move)
+            nodes, principal_variation = self.nodes, []
+            score = self.minimax(board=next_board, maximize=next_board.current_player == 1, alpha=-42, beta=42, depth=depth,
+                                 principal_variation=principal_variation)
+            analysis[move] = MoveAnalysis(score, [move] + principal_variation, self.nodes - nodes)
+
+        return analysis
+
+    def minimax(self, board: Board, maximize: bool, alpha: int, beta: int, depth: int,
+                principal_variation: Optional[list[int]] = None) -> int:
         """
         Searches into the all future board positions and evaluates them
         :param board: the board to evaluate
@@ -78,8 +159,14 @@ class Computer:
         :param alpha: parameter to prune branches, shows the highest possible score for a branch
         :param beta: parameter to prune branches, shows the lowest possible score for a branch
         :param depth: how many moves to algorythm shall look into the future
+        :param principal_variation: an empty list, gets filled with the expected moves leading to the evaluation
         :return: an evaluation of the board
         """
+        principal_variation = principal_variation if principal_variation is not None else []
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % 100 == 0 and time.perf_counter() > self.deadline:
+            raise TimeoutError("The search took longer than the time limit")
+
         game_over, winner, _ = board.is_game_over()
 
         # Scenario 1: game is over
@@ -88,33 +175,108 @@ class Computer:
                 return 0
             else:
                 return 42 * (1 if winner == 1 else -1)
-        # Scenario 2: depth exceeded, evaluate position using heuristics
+
+        # Scenario 2: the position was already searched with the same depth, e.g. after a different move order
+        # Deeper results don't get reused, so the evaluation stays the same as without the transposition table
+        key = (board.field.tobytes(), maximize)
+        entry = self.transposition_table.get(key)
+        if entry is not None:
+            entry_depth, entry_score, bound, entry_variation = entry
+            if entry_depth == depth and (bound == self.EXACT
+                                         or bound == self.LOWER_BOUND and entry_score >= beta
+                                         or bound == self.UPPER_BOUND and entry_score <= alpha):
+                principal_variation[:] = entry_variation
+                return entry_score
+
+        # Scenario 3: the threats on the board already decide the game
+        analyzer = ThreatAnalyzer(board)
+        player = board.current_player
+        opponent = 1 if player == 2 else 2
+        if analyzer.playable_threats(player):
+            principal_variation[:] = [analyzer.playable_threats(player)[0][0]]
+            return 42 * (1 if player == 1 else -1)
+        if analyzer.has_double_threat(opponent):
+            # Whichever threat gets blocked, the opponent wins with the other one, or on top of the blocked one
+            opponent_threats = analyzer.playable_threats(opponent)
+            blocked = opponent_threats[0][0]
+            principal_variation[:] = [blocked, opponent_threats[1][0] if len(opponent_threats) > 1 else blocked]
+            return 42 * (1 if opponent == 1 else -1)
+
+        # Scenario 4: the opponent threatens to win, so only the blocking move gets searched, without using up depth
+        forced_move = analyzer.forced_move(player)
+        if forced_move is not None:
+            moves, next_depth = [forced_move], depth
+        # Scenario 5: depth exceeded, evaluate position using heuristics
         elif depth == 0:
-            return self.eval_field(board)
-        # Scenario 3: minimax evaluation
-        elif maximize:
+            zugzwang_winner = analyzer.zugzwang_winner()
+            zugzwang_score = 0 if zugzwang_winner == 0 else self.ZUGZWANG_SCORE * (1 if zugzwang_winner == 1 else -1)
+            # Heuristic scores have to stay below the ones of a won game, otherwise they would be preferred over a real win
+            return max(-41, min(41, self.eval_field(board) + zugzwang_score))
+        else:
+            moves, next_depth = analyzer.safe_moves(player), depth - 1
+
+        # Searching the best move of an earlier search first leads to more cutoffs
+        if entry is not None and entry[3] and entry[3][0] in moves:
+            moves = [entry[3][0]] + [move for move in moves if move != entry[3][0]]
+
+        # Scenario 6: minimax evaluation
+        original_alpha, original_beta = alpha, beta
+        best_move = None
+        if maximize:
             max_eval = -42
-            for move in board.get_possible_moves():
+            for move in moves:
                 next_board = Board(board.field.copy())
                 next_board.place_marker(move)
-                score = self.minimax(board=next_board, maximize=False, alpha=alpha, beta=beta, depth=depth - 1)
-                max_eval = max(max_eval, score)
+                next_variation = []
+                score = self.minimax(board=next_board, maximize=False, alpha=alpha, beta=beta, depth=next_depth,
+                                     principal_variation=next_variation)
+                if best_move is None or score > max_eval:
+                    max_eval, best_move = score, move
+                    principal_variation[:] = [move] + next_variation
                 alpha = max(alpha, score)
                 if beta <= alpha:
                     break
+            self.store(key, depth, max_eval, original_alpha, original_beta, principal_variation)
             return max_eval
         else:
             min_eval = 42
-            for move in board.get_possible_moves():
+            for move in moves:
                 next_board = Board(board.field.copy())
                 next_board.place_marker(move)
-                score = self.minimax(board=next_board, maximize=True, alpha=alpha, beta=beta, depth=depth - 1)
-                min_eval = min(min_eval, score)
+                next_variation = []
+                score = self.minimax(board=next_board, maximize=True, alpha=alpha, beta=beta, depth=next_depth,
+                                     principal_variation=next_variation)
+                if best_move is None or score < min_eval:
+                    min_eval, best_move = score, move
+                    principal_variation[:] = [move] + next_variation
                 beta = min(beta, score)
                 if beta <= alpha:
                     break
+            self.store(key, depth, min_eval, original_alpha, original_beta, principal_variation)
             return min_eval
 
+    def store(self, key: tuple[bytes, bool], depth: int, score: int, alpha: int, beta: int,
+              principal_variation: list[int]) -> None:
+        """
+        Saves the result of a search in the transposition table
+        :param key: the field as bytes and if the position was maximized
+        :param depth: the depth the position was searched with
+        :param score: the score minimax returned
+        :param alpha: alpha at the start of the search, scores below it are only upper bounds
+        :param beta: beta at the start of the search, scores above it are only lower bounds
+        :param principal_variation: the expected moves leading to the score
+        :return: None, since this method is a modifier
+        """
+        if len(self.transposition_table) > self.TABLE_SIZE:
+            self.transposition_table.clear()
+        if score <= alpha:
+            bound = self.UPPER_BOUND
+        elif score >= beta:
+            bound = self.LOWER_BOUND
+        else:
+            bound = self.EXACT
+        self.transposition_table[key] = (depth, score, bound, tuple(principal_variation))
+
     def eval_field(self, board: Board) -> int:
         """
         Calculates the evaluation of the current board if depth of minimax is exceeded
@@ -1,8 +1,14 @@
 # Space for tests
+import io
+import json
+import random
+
 import numpy as np
 
+from archive import annotate_archive
 from board import Board
 from computer import Computer
+from threats import ThreatAnalyzer
 
 board = Board(np.zeros((6, 7)))
 board.place_marker(0)
@@ -38,3 +44,205 @@ print(board)
 
 comp = Computer(board=board, color=1)
 print(comp.calculate_move())
+
+
+def board_from_rows(rows: list[str]) -> Board:
+    """
+    Creates a board from its rows, written from top to bottom with . = empty, Y = yellow and R = red
+    :param rows: the six rows of the board
+    :return: the board
+    """
+    return Board(np.array([[".YR".index(cell) for cell in row] for row in rows], dtype=float))
+
+
+def solve(cells: list[list[int]], player: int, memo: dict) -> int:
+    """
+    Solves a position exactly by searching every move until the game is over, without any heuristics
+    :param cells: the field as nested lists, indexed [y][x]
+    :param player: the player to move
+    :param memo: already solved positions
+    :return: 42 if yellow wins, -42 if red wins, 0 for a draw
+    """
+    key = (str(cells), player)
+    if key in memo:
+        return memo[key]
+
+    results = []
+    for x in range(7):
+        y = max((y for y in range(6) if cells[y][x] == 0), default=None)
+        if y is None:
+            continue
+        cells[y][x] = player
+        wins = any(all(0 <= x + i * dx - k * dx < 7 and 0 <= y + i * dy - k * dy < 6
+                       and cells[y + i * dy - k * dy][x + i * dx - k * dx] == player for i in range(4))
+                   for dx, dy in ((1, 0), (0, 1), (1, 1), (1, -1)) for k in range(4))
+        results.append((42 if player == 1 else -42) if wins else solve(cells, 3 - player, memo))
+        cells[y][x] = 0
+
+    memo[key] = 0 if not results else max(results) if player == 1 else min(results)
+    return memo[key]
+
+
+def test_threats():
+    # Yellow can win on both sides of the bottom row, so red is lost
+    board = board_from_rows([".......", ".......", ".......", ".......", "..RR...", "..YYY.."])
+    analyzer = ThreatAnalyzer(board)
+    assert analyzer.playable_threats(1) == [(1, 5), (5, 5)]
+    assert analyzer.has_double_threat(1) and not analyzer.has_double_threat(2)
+    assert analyzer.forced_move(2) is None
+    assert Computer(board, 2).minimax(board, maximize=False, alpha=-42, beta=42, depth=2) == 42
+
+    # Red has to block yellow in column 3, but then yellow wins on top of it
+    board = board_from_rows([".......", ".......", ".......", "RR.....", "YYY..R.", "YYY..RR"])
+    analyzer = ThreatAnalyzer(board)
+    assert analyzer.playable_threats(1) == [(3, 5)] and analyzer.future_threats(1) == [(3, 4)]
+    assert analyzer.has_double_threat(1)
+    assert Computer(board, 2).minimax(board, maximize=False, alpha=-42, beta=42, depth=2) == 42
+
+    # Only one threat, so red is forced to block it
+    board = board_from_rows([".......", ".......", ".......", ".......", ".......", "RYYY..R"])
+    analyzer = ThreatAnalyzer(board)
+    assert analyzer.forced_move(2) == 4 and analyzer.forced_move(1) is None
+    assert not analyzer.has_double_threat(1)
+
+    # Both possible moves let red win on top, so yellow has to play one of them anyway
+    board = board_from_rows(["Y.YR.RY", "R.RY.YR", "R.RR.RY", "Y.YR.YR", "Y.RY.RY", "YRYRYYR"])
+    analyzer = ThreatAnalyzer(board)
+    assert analyzer.column_heights[1] == analyzer.column_heights[4] == 4
+    assert {(1, 3), (4, 3)} <= set(analyzer.future_threats(2))
+    assert analyzer.safe_moves(1) == [4, 1]
+
+    # Yellow has a threat in an odd row, red none in an even row
+    board = board_from_rows([".......", ".......", "...Y...", ".Y.R...", ".R.R.Y.", "RRYRYYY"])
+    assert ThreatAnalyzer(board).future_threats(1) == [(4, 3)]
+    assert ThreatAnalyzer(board).zugzwang_winner() == 1
+
+    # Yellows threat is in an even row and of no use, the one of red is
+    board = board_from_rows([".......", ".......", ".......", ".R.Y...", ".YYR.RR", ".YRY.YR"])
+    assert ThreatAnalyzer(board).future_threats(1) == [(4, 2)] and ThreatAnalyzer(board).future_threats(2) == [(4, 4)]
+    assert ThreatAnalyzer(board).zugzwang_winner() == 2
+
+
+def test_heuristic_scores_stay_below_wins():
+    # Yellow is predicted to win by zugzwang on top of a high heuristic score, but the game is far from over
+    board = board_from_rows([".......", ".......", "..Y....", "R.YY...", "R.RYR..", "Y.YRR.."])
+    for move in [3, 3, 4]:
+        board.place_marker(move)
+    assert ThreatAnalyzer(board).zugzwang_winner() == 1
+    computer = Computer(board, 1)
+    assert computer.eval_field(board) + computer.ZUGZWANG_SCORE > 42
+    assert computer.minimax(board, maximize=False, alpha=-42, beta=42, depth=0) == 41
+
+    random.seed(42)
+    for _ in range(300):
+        board = Board(np.zeros((6, 7)))
+        for _ in range(random.randint(4, 30)):
+            board.place_marker(random.choice(board.get_possible_moves()))
+            if board.is_game_over()[0]:
+                break
+        if board.is_game_over()[0]:
+            continue
+
+        analyzer = ThreatAnalyzer(board)
+        if analyzer.playable_threats(1) or analyzer.playable_threats(2):
+            continue
+        score = Computer(board, board.current_player).minimax(board, maximize=board.current_player == 1,
+                                                              alpha=-42, beta=42, depth=0)
+        assert abs(score) < 42, board
+
+
+def test_minimax_is_exact():
+    # Searching until the board is full must give the same result as solving the position without threat cutoffs
+    random.seed(26)
+    positions = 0
+    while positions < 40:
+        board = Board(np.zeros((6, 7)))
+        for _ in range(random.randint(28, 36)):
+            board.place_marker(random.choice(board.get_possible_moves()))
+            if board.is_game_over()[0]:
+                break
+        if board.is_game_over()[0]:
+            continue
+
+        computer = Computer(board, board.current_player)
+        score = computer.minimax(board, maximize=board.current_player == 1, alpha=-42, beta=42, depth=42 - board.filled_fields())
+        assert score == solve(board.field.astype(int).tolist(), board.current_player, {}), board
+        positions += 1
+
+
+def test_analyze():
+    board = board_from_rows([".......", ".......", ".......", ".......", ".......", "...Y..."])
+    computer = Computer(board, 2)
+    computer.analyze(board, depth=4)
+
+    # Nothing of the deeper analysis before may end up in this one
+    analysis = computer.analyze(board, depth=0)
+    assert all(move_analysis.principal_variation == [move] and move_analysis.nodes == 1
+               for move, move_analysis in analysis.items())
+
+    # The nodes of every depth are counted
+    analysis = computer.analyze(board, depth=2, time_limit=60)
+    assert sum(move_analysis.nodes for move_analysis in analysis.values()) == computer.nodes
+
+    # Sharing the transposition table never visits more positions than searching every move on its own
+    board = board_from_rows([".......", ".......", "..Y....", "R.YY...", "R.RYR..", "Y.YRR.."])
+    computer = Computer(board, 1)
+    analysis = computer.analyze(board, depth=4)
+    nodes = 0
+    for move in board.get_possible_moves():
+        next_board = Board(board.field.copy())
+        next_board.place_marker(move)
+        single_computer = Computer(board, 1)
+        assert single_computer.minimax(next_board, maximize=False, alpha=-42, beta=42, depth=4) == analysis[move].value
+        nodes += single_computer.nodes
+    assert computer.nodes <= nodes
+
+    # Nothing is decided in this position, so no heuristic value may look like a win
+    analysis = computer.analyze(board, depth=1)
+    assert all(abs(move_analysis.value) < 42 for move_analysis in analysis.values()), analysis
+
+    # The deadline must not outlive an analysis that failed
+    def failing_eval_field(_):
+        if computer.deadline is not None:
+            raise RuntimeError("eval_field failed")
+        return 0
+    computer.eval_field = failing_eval_field
+    try:
+        computer.analyze(board, depth=2, time_limit=60)
+    except RuntimeError:
+        pass
+    assert computer.deadline is None
+
+    # The principal variation of a won position ends with the winning move
+    board = board_from_rows([".......", ".......", ".......", ".......", "..RR...", "..YYY.."])
+    for move, move_analysis in Computer(board, 2).analyze(board, depth=2).items():
+        next_board = Board(board.field.copy())
+        for column in move_analysis.principal_variation:
+            next_board.place_marker(column)
+        assert move_analysis.value == 42 and next_board.is_game_over()[:2] == (True, 1), move_analysis
+
+
+def test_annotate_archive():
+    archive = ["# example archive", "3324", "3,3,2,4", "abc", "0000000", "12121213", "33"]
+    output, reports = io.StringIO(), []
+    annotate_archive(archive, output, processes=1, depth=1, progress=reports.append)
+    annotations = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert [annotation["line"] for annotation in annotations] == [2, 3, 4, 5, 6, 7]
+    assert annotations[0]["plies"] == annotations[1]["plies"] and len(annotations[0]["plies"]) == 4
+    assert annotations[2]["error"] == "Line 4 is not a valid game record: 'abc'"
+    assert annotations[3]["error"] == "Cannot place marker because the column is full"
+    assert annotations[4]["error"] == "Cannot place marker because the game is already over"
+    assert [ply["move"] for ply in annotations[5]["plies"]] == [3, 3]
+
+    # The repeated game and both positions of the last game were already analyzed
+    assert reports[-1].startswith("6 games, 10 positions (6 from cache)")
+
+
+if __name__ == "__main__":
+    test_threats()
+    test_heuristic_scores_stay_below_wins()
+    test_minimax_is_exact()
+    test_analyze()
+    test_annotate_archive()
+    print("All tests passed")
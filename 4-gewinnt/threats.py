@@ -0,0 +1,159 @@
+from functools import lru_cache
+from typing import Optional
+
+from board import Board
+
+
+@lru_cache(maxsize=None)
+def get_windows(width: int, height: int) -> tuple[tuple[tuple[int, int], ...], ...]:
+    """
+    Lists every selection of four neighboring fields in which a connect-4 can be scored
+    :param width: width of the field
+    :param height: height of the field
+    :return: a tuple containing the (x, y) coords of the four fields of every selection
+    """
+    windows = []
+    for x in range(width):
+        for y in range(height):
+            if x + 3 < width:
+                windows.append(tuple((x + i, y) for i in range(4)))
+            if y + 3 < height:
+                windows.append(tuple((x, y + i) for i in range(4)))
+            if x + 3 < width and y + 3 < height:
+                windows.append(tuple((x + i, y + i) for i in range(4)))
+                windows.append(tuple((x + i, y + 3 - i) for i in range(4)))
+
+    return tuple(windows)
+
+
+class ThreatAnalyzer:
+    """
+    A threat is an empty field that would complete a connect-4 for a player once their marker lands on it
+    """
+    board: Board
+    width: int
+    height: int
+
+    threats: dict[int, set[tuple[int, int]]]
+    column_heights: list[int]  # y-index of the next free field of every column, -1 if the column is full
+
+    def __init__(self, board: Board):
+        """
+        Collects the threats of both players on the given board
+        :param board: the board to analyze
+        """
+        self.board = board
+        self.height, self.width = board.field.shape
+        cells = board.field.tolist()  # plain lists are a lot faster to index than the ndarray
+
+        self.column_heights = []
+        for x in range(self.width):
+            y = self.height - 1
+            while y >= 0 and cells[y][x] != 0:
+                y -= 1
+            self.column_heights.append(y)
+
+        self.threats = {1: set(), 2: set()}
+        for window in get_windows(self.width, self.height):
+            selection = [cells[y][x] for x, y in window]
+            if selection.count(0) != 1:
+                continue
+            for player in (1, 2):
+                if selection.count(player) == 3:
+                    self.threats[player].add(window[selection.index(0)])
+
+    def is_playable(self, x: int, y: int) -> bool:
+        """
+        Checks if a marker dropped into column x would land on the field (x, y)
+        :param x: x-coordinate
+        :param y: y-coordinate
+        :return: Boolean
+        """
+        return self.column_heights[x] == y
+
+    def is_odd_row(self, y: int) -> bool:
+        """
+        Checks if y is an odd row, counting the rows from 1 at the bottom of the board
+        :param y: y-coordinate
+        :return: Boolean
+        """
+        return (self.height - y) % 2 == 1
+
+    def playable_threats(self, player: int) -> list[tuple[int, int]]:
+        """
+        Returns the threats the player can complete with the very next marker
+        :param player: 1 = yellow, 2 = red
+        :return: List of (x, y) coords
+        """
+        return sorted(field for field in self.threats[player] if self.is_playable(*field))
+
+    def future_threats(self, player: int) -> list[tuple[int, int]]:
+        """
+        Returns the threats of the player that still need markers below them before they can be completed
+        :param player: 1 = yellow, 2 = red
+        :return: List of (x, y) coords
+        """
+        return sorted(field for field in self.threats[player] if not self.is_playable(*field))
+
+    def has_double_threat(self, player: int) -> bool:
+        """
+        Checks if the player has threats the opponent can no longer block with a single marker.
+        This is the case for two playable threats, or a playable threat with another threat stacked directly on top
+        :param player: 1 = yellow, 2 = red
+        :return: Boolean
+        """
+        playable_threats = self.playable_threats(player)
+        if len(playable_threats) > 1:
+            return True
+
+        return any((x, y - 1) in self.threats[player] for x, y in playable_threats)
+
+    def forced_move(self, player: int) -> Optional[int]:
+        """
+        Returns the column the player has to block because the opponent could win there with the next marker
+        :param player: the player to move, 1 = yellow, 2 = red
+        :return: the x-index of the column, None if the player is free to choose
+        """
+        opponent_threats = self.playable_threats(1 if player == 2 else 2)
+        if len(opponent_threats) != 1:
+            return None
+
+        return opponent_threats[0][0]
+
+    def safe_moves(self, player: int) -> list[int]:
+        """
+        Returns the possible moves without those, that allow the opponent to win by placing a marker on top.
+        If every move does so, all possible moves get returned
+        :param player: the player to move, 1 = yellow, 2 = red
+        :return: List of column indices, in the same order as Board.get_possible_moves
+        """
+        opponent = 1 if player == 2 else 2
+        possible_moves = self.board.get_possible_moves()
+        safe_moves = [x for x in possible_moves if (x, self.column_heights[x] - 1) not in self.threats[opponent]]
+
+        return safe_moves or possible_moves
+
+    def zugzwang_winner(self) -> int:
+        """
+        Applies the odd/even rules to predict who wins once the board fills up.
+        Since the players take turns, yellow tends to get the fields in odd rows and red the ones in even rows,
+        so only odd threats of yellow and even threats of red are of use. In every column only the lowest of them counts,
+        as the threats above it never get reached
+        :return: the predicted winner (1 = yellow, 2 = red), 0 if the rules do not decide the game
+        """
+        odd_threats, even_threats = 0, 0
+        for x in range(self.width):
+            for y in range(self.column_heights[x], -1, -1):
+                if (x, y) in self.threats[1] and self.is_odd_row(y):
+                    odd_threats += 1
+                    break
+                if (x, y) in self.threats[2] and not self.is_odd_row(y):
+                    even_threats += 1
+                    break
+
+        if odd_threats and not even_threats:
+            return 1
+        if even_threats and not odd_threats:
+            return 2
+
+        return 0